@@ -1,14 +1,30 @@
 ﻿import os
 import json
+import hashlib
 import shutil
 import zipfile
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext
 from bs4 import BeautifulSoup, NavigableString
-from transformers import M2M100ForConditionalGeneration, M2M100Tokenizer
+from transformers import AutoTokenizer, M2M100ForConditionalGeneration, M2M100Tokenizer
 import torch
 import threading
+import time
+import queue
 import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import lxml.html  # Optional: C parser for fast text extraction
+    HAVE_LXML = True
+except ImportError:
+    HAVE_LXML = False
+
+try:
+    import orjson  # Optional: much faster JSON parsing and serialization
+except ImportError:
+    orjson = None
 
 # === Local AI Translator Setup ===
 # MODEL_NAME = "facebook/m2m100_418M"      # Smaller, faster, less accurate
@@ -33,48 +49,315 @@ SUPPORTED_LANGUAGES = {
 
 SOURCE_LANG = "en"
 TARGET_LANG = "de"
+
+# Per-string debug output (set H5P_TRANSLATE_DEBUG=1); off by default because
+# printing every string serializes the translation on console and log I/O
+DEBUG = os.environ.get("H5P_TRANSLATE_DEBUG") == "1"
+
+# Optional CTranslate2 backend (C++ decoder, int8), used when ctranslate2 is
+# installed and CT2_MODEL_DIR holds a converted model. Set AUTO_CONVERT_CT2 = True
+# to convert the model on first run (takes several minutes), or convert by hand:
+#   ct2-transformers-converter --model facebook/m2m100_1.2B --quantization int8 --output_dir m2m100_ct2
+CT2_MODEL_DIR = "m2m100_ct2"
+AUTO_CONVERT_CT2 = False
+
+# Compile the model's forward pass with CUDA graphs (GPU only, PyTorch 2+).
+# Inputs are padded to fixed bucket lengths so the captured graphs get reused.
+USE_TORCH_COMPILE = True
+PAD_BUCKETS = (32, 64, 128, 256)
+
+# Load the weights as INT8 through bitsandbytes on GPU: less memory and weight
+# bandwidth, leaving room for larger batches. Falls back to FP16 if unavailable.
+LOAD_IN_8BIT = False
+# INT8 weight-only quantization through torchao on GPU. Unlike LOAD_IN_8BIT it
+# works with torch.compile, which fuses the dequantization into the matmuls.
+TORCHAO_INT8 = False
+
 device = "cuda" if torch.cuda.is_available() else "cpu"
-tokenizer = M2M100Tokenizer.from_pretrained(MODEL_NAME)
-model = M2M100ForConditionalGeneration.from_pretrained(MODEL_NAME).to(device)
-tokenizer.src_lang = SOURCE_LANG
+try:
+    # Picks a Rust-backed tokenizer if one exists for MODEL_NAME. M2M100 has none in
+    # current transformers releases, so this normally returns the SentencePiece one
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, use_fast=True)
+except Exception as e:
+    print(f"[WARN] AutoTokenizer failed, using M2M100Tokenizer: {e}")
+    tokenizer = M2M100Tokenizer.from_pretrained(MODEL_NAME)
+print(f"[INFO] Tokenizer: {type(tokenizer).__name__} (fast: {getattr(tokenizer, 'is_fast', False)})")
 
-def translate_local_ai(text, target_lang=TARGET_LANG):
-    """Translation with length and quality controls"""
-    if not text or not text.strip():
-        return text
-    
-    # Clean up input text
+def lang_token(lang):
+    """M2M100 language token such as __de__, valid for both slow and fast tokenizers"""
+    return f"__{lang}__"
+
+# Packed GEMM speeds up CTranslate2's int8 matmuls on CPU; it must be set before the import
+os.environ.setdefault("CT2_USE_EXPERIMENTAL_PACKED_GEMM", "1")
+try:
+    import ctranslate2
+except ImportError:
+    ctranslate2 = None
+
+ct2_translator = None
+if ctranslate2 is not None:
+    try:
+        if AUTO_CONVERT_CT2 and not os.path.isdir(CT2_MODEL_DIR):
+            print(f"[INFO] Converting {MODEL_NAME} to CTranslate2 format in {CT2_MODEL_DIR} (one-time)...")
+            # Convert next to the target and move it into place only when complete, so an
+            # interrupted conversion is retried on the next start instead of being loaded
+            partial_dir = CT2_MODEL_DIR + ".partial"
+            try:
+                ctranslate2.converters.TransformersConverter(MODEL_NAME).convert(
+                    partial_dir, quantization="int8", force=True
+                )
+                os.replace(partial_dir, CT2_MODEL_DIR)
+            finally:
+                shutil.rmtree(partial_dir, ignore_errors=True)
+        if os.path.isdir(CT2_MODEL_DIR):
+            ct2_translator = ctranslate2.Translator(
+                CT2_MODEL_DIR, device=device,
+                compute_type="int8_float16" if device == "cuda" else "int8",
+                # CTranslate2 only uses 4 threads by default; give each batch every core
+                intra_threads=(os.cpu_count() or 0) if device == "cpu" else 0
+            )
+            print(f"[INFO] Using CTranslate2 model from {CT2_MODEL_DIR}")
+    except Exception as e:
+        print(f"[WARN] Could not load CTranslate2 model, falling back to transformers: {e}")
+elif os.path.isdir(CT2_MODEL_DIR):
+    print(f"[WARN] {CT2_MODEL_DIR} found but ctranslate2 is not installed, using transformers")
+
+# One model instance is shared by all files being translated; generate calls take turns
+generate_lock = threading.Lock()
+
+model = None
+model_compiled = False
+# Which weights and runtime produce the translations; part of the saved cache's fingerprint
+model_backend = f"ctranslate2-{device}-int8"
+if ct2_translator is None:
+    # Half precision on GPU halves the memory traffic of decoding; CPU stays in FP32
+    dtype = torch.float16 if device == "cuda" else torch.float32
+    if device == "cuda":
+        # Any matmul left in FP32 (e.g. outside FP16/INT8 layers) may use TF32 tensor cores on Ampere+
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+    model_in_8bit = False
+    if device == "cuda" and LOAD_IN_8BIT:
+        try:
+            from transformers import BitsAndBytesConfig
+            model = M2M100ForConditionalGeneration.from_pretrained(
+                MODEL_NAME, quantization_config=BitsAndBytesConfig(load_in_8bit=True), device_map="auto"
+            ).eval()
+            model_in_8bit = True
+            model_backend = "transformers-cuda-bnb-int8"
+        except Exception as e:
+            print(f"[WARN] 8-bit loading unavailable, using FP16: {e}")
+    if model is None:
+        model = M2M100ForConditionalGeneration.from_pretrained(MODEL_NAME, torch_dtype=dtype).to(device).eval()
+        model_backend = f"transformers-{device}-fp16"
+    if device == "cpu":
+        # INT8 dynamic quantization of the Linear layers is much faster than FP32 on CPU
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        model_backend = "transformers-cpu-int8"
+    elif TORCHAO_INT8 and not model_in_8bit:
+        try:
+            from torchao.quantization import quantize_, Int8WeightOnlyConfig
+            quantize_(model, Int8WeightOnlyConfig())
+            model_backend = "transformers-cuda-torchao-int8"
+        except Exception as e:
+            print(f"[WARN] torchao INT8 quantization unavailable, using FP16: {e}")
+    if device == "cuda" and USE_TORCH_COMPILE and hasattr(torch, "compile") and not model_in_8bit:
+        model.forward = torch.compile(model.forward, mode="reduce-overhead", fullgraph=False)
+        model_compiled = True
+    if device == "cuda" and getattr(model, "_supports_static_cache", False):
+        # Preallocated KV cache: no allocator churn per call and fixed shapes for CUDA graphs
+        model.generation_config.cache_implementation = "static"
+
+# Greedy decoding is several times cheaper than beam search and good enough for
+# short UI strings; set QUALITY_MODE = True to get beam search back
+QUALITY_MODE = False
+# Even in quality mode, short labels and answers are decoded greedily: beams
+# triple the decoder work there without a visible difference
+SHORT_INPUT_TOKENS = 12
+BEAM_SIZE_SHORT = 1
+BEAM_SIZE_LONG = 3 if QUALITY_MODE else 1
+NUM_BEAMS = BEAM_SIZE_LONG
+RETRY_BEAMS = 3  # Beam size for a second try when greedy output is unusable; 1 disables it
+
+def beams_for_length(num_tokens):
+    """Beam size for an input of num_tokens tokens"""
+    return BEAM_SIZE_SHORT if num_tokens < SHORT_INPUT_TOKENS else BEAM_SIZE_LONG
+
+BATCH_SIZE = 64 if device == "cuda" else 16  # Chunks per model.generate call
+MAX_INPUT_TOKENS = 220   # Per-chunk token budget, below the 256-token truncation limit
+BUCKET_GROWTH = 1.3      # Max length ratio between the longest and shortest chunk in a batch
+
+# A sentence up to and including the whitespace after its closing punctuation, or the
+# unterminated tail of the text. The punctuation must follow two word characters, so
+# "2.5", "e.g. " and a "..." at the start or after a space do not end a sentence;
+# longer abbreviations ("Dr. ") still do, which only moves a chunk boundary
+SENTENCE_RE = re.compile(r'.*?\w\w[.!?]+(?:\s+|$)|.+', re.DOTALL)
+
+def split_into_chunks(text, max_input_tokens=MAX_INPUT_TOKENS):
+    """Split long text into sentence-aligned chunks of at most max_input_tokens tokens"""
     text = text.strip()
+    # Every token covers at least one character, so short texts never need splitting
+    if len(text) <= max_input_tokens:
+        return [text]
     
-    # Limit input length to prevent truncation
-    max_input_length = 200  # Conservative limit
-    if len(text) > max_input_length:
-        # Split by sentences and translate parts
-        sentences = re.split(r'([.!?]+)', text)
-        translated_parts = []
-        current_chunk = ""
-        
-        for i in range(0, len(sentences), 2):
-            sentence = sentences[i] if i < len(sentences) else ""
-            punctuation = sentences[i+1] if i+1 < len(sentences) else ""
-            full_sentence = sentence + punctuation
+    # Count tokens for all sentences in one tokenizer call, then pack them greedily.
+    # The pieces keep their whitespace, so joining them restores the original text
+    sentences = [m.group() for m in SENTENCE_RE.finditer(text)]
+    if "".join(sentences) != text:
+        return [text]  # Never send the model a text the split would change
+    counts = [len(ids) for ids in tokenizer(sentences, add_special_tokens=False)["input_ids"]]
+    
+    chunks = []
+    current_chunk = []
+    current_tokens = 0
+    for sentence, count in zip(sentences, counts):
+        if current_chunk and current_tokens + count > max_input_tokens:
+            chunks.append("".join(current_chunk).strip())
+            current_chunk = []
+            current_tokens = 0
+        # A single sentence over the budget becomes its own chunk
+        current_chunk.append(sentence)
+        current_tokens += count
+    
+    if current_chunk:
+        chunks.append("".join(current_chunk).strip())
+    
+    return chunks
+
+# Strings that never need the model: blank, URLs, hex colours, numbers/punctuation,
+# single characters, H5P placeholders (@score, %correct, :num), UUIDs, media file names and bare paths
+SKIP_TRANSLATION_RE = re.compile(
+    r'^\s*$|^https?://|^#[0-9A-Fa-f]{3,8}$|^[\d\W_]+$|^.{0,1}$|^[@%:][A-Za-z]\w*$'
+    r'|^[0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{12}$'
+    r'|^[\w./-]+\.(?:png|jpe?g|gif|svg|webp|mp4|webm|mp3|ogg|wav|pdf)$'
+    r'|^/\S*$',
+    re.IGNORECASE
+)
+
+def should_translate(text):
+    """False for strings the model would only copy or mangle"""
+    return bool(text) and not SKIP_TRANSLATION_RE.match(text.strip())
+
+# Translations keyed by (source language, target language, canonical text), so
+# repeated button labels, feedback and answer options are only translated once
+_TCACHE = {}
+# Whole translated HTML fields keyed by (source language, target language, html)
+_HTML_CACHE = {}
+TCACHE_MAX_ENTRIES = 8192  # Per cache; the oldest entries are dropped first
+# Translations are kept here between runs, so re-translating an edited package
+# only sends the changed strings to the model; set to None to disable
+TCACHE_FILE = "translation-cache.json"
+
+# Files translated in parallel share the caches; eviction must not interleave
+_CACHE_LOCK = threading.Lock()
+
+def cache_put(cache, key, value):
+    """Store value in an insertion-ordered cache, evicting the oldest entry when full"""
+    with _CACHE_LOCK:
+        cache[key] = value
+        if len(cache) > TCACHE_MAX_ENTRIES:
+            del cache[next(iter(cache))]
+
+def canonical_text(text):
+    """Text with runs of whitespace collapsed; strings that differ only in
+    spacing or line breaks share one translation"""
+    return " ".join(text.split())
+
+def translate_texts(texts, target_lang=TARGET_LANG, stats=None, source_lang=SOURCE_LANG, failed=None):
+    """Translate a list of strings using batched model calls, preserving order.
+    If a stats dict is given, its "hits" and "translated" counts are increased.
+    Texts the model failed on come back unchanged; if a failed set is given, their indexes are added."""
+    results = list(texts)
+    
+    # Serve repeated strings from the cache; only distinct misses reach the model
+    pending = {}
+    lookups = 0
+    for idx, text in enumerate(texts):
+        if not should_translate(text):
+            continue
+        lookups += 1
+        cache_key = (source_lang, target_lang, canonical_text(text))
+        cached = _TCACHE.get(cache_key)
+        if cached is not None:
+            results[idx] = cached
+        else:
+            pending.setdefault(cache_key, []).append(idx)
+    
+    if stats is not None:
+        # Every lookup that does not reach the model counts as a hit, including
+        # repeats of a string that is translated for the first time in this call
+        stats["hits"] = stats.get("hits", 0) + lookups - len(pending)
+        stats["translated"] = stats.get("translated", 0) + len(pending)
+    
+    if not pending:
+        return results
+    
+    # Flatten every text into chunks, remembering which text each chunk belongs to
+    pending_keys = list(pending)
+    chunks = []
+    chunk_owners = []
+    for owner, cache_key in enumerate(pending_keys):
+        for chunk in split_into_chunks(cache_key[2]):
+            chunks.append(chunk)
+            chunk_owners.append(owner)
+    
+    # Tokenize every chunk once; the token ids give the batch ordering below and
+    # are handed to encode_batch, so no chunk is tokenized a second time
+    chunk_ids = tokenizer(chunks, add_special_tokens=False, truncation=True, max_length=254)["input_ids"]
+    # Sort by token length so each batch pads to a similar length
+    lengths = [len(ids) for ids in chunk_ids]
+    order = sorted(range(len(chunks)), key=lambda i: lengths[i])
+    
+    # Start a new batch when the current one is full or the next chunk is much longer
+    # than the batch's shortest, so padding stays close to the real sequence lengths
+    batches = []
+    for i in order:
+        if batches:
+            batch = batches[-1]
+            shortest = lengths[batch[0]]
+            if (len(batch) < BATCH_SIZE and lengths[i] <= max(shortest * BUCKET_GROWTH, shortest + 8)
+                    and beams_for_length(lengths[i]) == beams_for_length(shortest)):
+                batch.append(i)
+                continue
+        batches.append([i])
+    
+    # Tokenize the next batch on a worker thread while the model runs the current one
+    translated_chunks = [None] * len(chunks)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_encoding = executor.submit(encode_batch, [chunks[i] for i in batches[0]], source_lang,
+                                        [chunk_ids[i] for i in batches[0]])
+        for n, batch_indices in enumerate(batches):
+            try:
+                encoded = next_encoding.result()
+            except Exception as e:
+                print(f"[TRANSLATE-ERROR] Tokenization error: {e}")
+                encoded = None  # translate_batch retries and handles the error
+            if n + 1 < len(batches):
+                next_encoding = executor.submit(encode_batch, [chunks[i] for i in batches[n + 1]], source_lang,
+                                                [chunk_ids[i] for i in batches[n + 1]])
             
-            if len(current_chunk + full_sentence) > max_input_length:
-                if current_chunk:
-                    translated_parts.append(translate_single_chunk(current_chunk.strip(), target_lang))
-                    current_chunk = full_sentence
-                else:
-                    # Single sentence too long, translate as-is
-                    translated_parts.append(translate_single_chunk(full_sentence.strip(), target_lang))
-            else:
-                current_chunk += full_sentence
-        
-        if current_chunk:
-            translated_parts.append(translate_single_chunk(current_chunk.strip(), target_lang))
-        
-        return " ".join(translated_parts)
-    else:
-        return translate_single_chunk(text, target_lang)
+            num_beams = beams_for_length(lengths[batch_indices[-1]])
+            batch_results = translate_batch([chunks[i] for i in batch_indices], target_lang, num_beams,
+                                            encoded=encoded, source_lang=source_lang)
+            for i, translated in zip(batch_indices, batch_results):
+                translated_chunks[i] = translated
+    
+    # Reassemble chunks back into their original texts. A text with a failed chunk
+    # keeps its exact source text and stays out of the cache, so a later call retries it
+    parts = {}
+    for owner, translated in zip(chunk_owners, translated_chunks):
+        parts.setdefault(owner, []).append(translated)
+    for owner, translated_parts in parts.items():
+        if None in translated_parts:
+            if failed is not None:
+                failed.update(pending[pending_keys[owner]])
+            continue
+        translated = " ".join(translated_parts)
+        cache_put(_TCACHE, pending_keys[owner], translated)
+        for idx in pending[pending_keys[owner]]:
+            results[idx] = translated
+    
+    return results
 
 # === Translation Corrections Dictionary ===
 TRANSLATION_CORRECTIONS = {
@@ -94,105 +377,223 @@ TRANSLATION_CORRECTIONS = {
     "breadboard": "Steckbrett",
 }
 
+def compile_corrections(corrections_dict):
+    """Build one case-insensitive whole-word regex for all terms, longest first"""
+    terms = sorted(corrections_dict, key=len, reverse=True)
+    pattern = re.compile(r"\b(" + "|".join(re.escape(term) for term in terms) + r")\b", re.IGNORECASE)
+    lookup = {term.lower(): replacement for term, replacement in corrections_dict.items()}
+    return pattern, lookup
+
+_CORRECTIONS_RE, _CORRECTIONS_LOOKUP = compile_corrections(TRANSLATION_CORRECTIONS)
+
 def apply_translation_corrections(text, corrections_dict):
     """Apply manual corrections to translated text"""
-    corrected = text
-    for english_term, german_term in corrections_dict.items():
-        # Case-insensitive replacement, preserving original case pattern
-        import re
-        pattern = re.compile(re.escape(english_term), re.IGNORECASE)
-        
-        def replace_match(match):
-            original = match.group()
-            if original.isupper():
-                return german_term.upper()
-            elif original.istitle():
-                return german_term.capitalize()
-            else:
-                return german_term.lower()
-        
-        corrected = pattern.sub(replace_match, corrected)
+    if corrections_dict is TRANSLATION_CORRECTIONS:
+        pattern, lookup = _CORRECTIONS_RE, _CORRECTIONS_LOOKUP
+    else:
+        pattern, lookup = compile_corrections(corrections_dict)
+    
+    def replace_match(match):
+        # Preserve the original case pattern
+        original = match.group()
+        german_term = lookup[original.lower()]
+        if original.isupper():
+            return german_term.upper()
+        elif original.istitle():
+            return german_term.capitalize()
+        else:
+            return german_term.lower()
+    
+    return pattern.sub(replace_match, text)
+
+def encode_batch(texts, source_lang=SOURCE_LANG, token_ids=None):
+    """Tokenize a batch on the CPU so it is ready for translate_batch.
+    token_ids can hold the texts' tokens (without special tokens) if they are already known."""
+    if token_ids is None:
+        token_ids = tokenizer(texts, add_special_tokens=False, truncation=True, max_length=254)["input_ids"]
+    # Add M2M100's source language prefix and EOS ourselves instead of setting
+    # tokenizer.src_lang, so files in different languages can share the tokenizer
+    lang_id = tokenizer.convert_tokens_to_ids(lang_token(source_lang))
+    input_ids = [[lang_id] + ids + [tokenizer.eos_token_id] for ids in token_ids]
+    if ct2_translator is not None:
+        return [tokenizer.convert_ids_to_tokens(ids) for ids in input_ids]
     
-    return corrected
+    encoded = {"input_ids": input_ids, "attention_mask": [[1] * len(ids) for ids in input_ids]}
+    if model_compiled:
+        # Pad to a fixed bucket so compiled graphs are reused across batches
+        longest = max(len(ids) for ids in encoded["input_ids"])
+        pad_to = next(bucket for bucket in PAD_BUCKETS if bucket >= longest)
+        encoded = tokenizer.pad(encoded, padding="max_length", max_length=pad_to, return_tensors="pt")
+    else:
+        encoded = tokenizer.pad(encoded, padding=True, return_tensors="pt")
+    if device == "cuda":
+        # Pinned memory lets the copy to the GPU run asynchronously
+        encoded = {key: tensor.pin_memory() for key, tensor in encoded.items()}
+    return encoded
+
+def max_new_tokens_for(input_length):
+    """Decoding budget for a batch whose longest input has input_length tokens.
+    Translations rarely run past twice their source, so this only cuts off runaway output."""
+    return min(400, input_length * 2 + 16)
+
+def generate_with_ctranslate2(sources, target_lang, num_beams=NUM_BEAMS):
+    """Run tokenized sources through the CTranslate2 model and decode them with the HF tokenizer"""
+    target_prefix = [[lang_token(target_lang)]] * len(sources)
+    results = ct2_translator.translate_batch(
+        sources, target_prefix=target_prefix, beam_size=num_beams,
+        # The forced language token counts towards CTranslate2's decoding length
+        max_decoding_length=max_new_tokens_for(max(len(source) for source in sources)) + 1
+    )
+    # Drop the forced target language token before decoding
+    return [
+        tokenizer.decode(tokenizer.convert_tokens_to_ids(result.hypotheses[0][1:]), skip_special_tokens=True)
+        for result in results
+    ]
 
-def translate_single_chunk(text, target_lang=TARGET_LANG):
-    """Translate a single chunk with error handling and corrections"""
+def translate_batch(texts, target_lang=TARGET_LANG, num_beams=NUM_BEAMS, encoded=None, source_lang=SOURCE_LANG):
+    """Translate a batch of chunks in a single generate call, with error handling and corrections.
+    
+    encoded can hold the output of encode_batch(texts, source_lang) when it was prepared ahead of time.
+    Chunks that failed or came back unusable are None, so callers never mistake them for translations.
+    """
     try:
-        log_text = text[:50] + "..." if len(text) > 50 else text
-        print(f"[TRANSLATE-DEBUG] Input: '{log_text}'")
+        if DEBUG:
+            for text in texts:
+                log_text = text[:50] + "..." if len(text) > 50 else text
+                print(f"[TRANSLATE-DEBUG] Input: '{log_text}'")
         
-        encoded = tokenizer(text, return_tensors="pt", truncation=True, max_length=256).to(device)
-        generated = model.generate(
-            **encoded,
-            forced_bos_token_id=tokenizer.lang_code_to_id[target_lang],
-            max_length=400,  # Increased max length
-            num_beams=3,     # Better quality
-            early_stopping=True,
-            pad_token_id=tokenizer.pad_token_id
-        )
-        result = tokenizer.decode(generated[0], skip_special_tokens=True)
+        if encoded is None:
+            encoded = encode_batch(texts, source_lang)
         
+        if ct2_translator is not None:
+            with generate_lock:
+                decoded = generate_with_ctranslate2(encoded, target_lang, num_beams)
+        else:
+            # Longest real input in the batch; input_ids may be padded up to a bucket length
+            input_length = int(encoded["attention_mask"].sum(dim=1).max())
+            encoded = {key: tensor.to(device, non_blocking=True) for key, tensor in encoded.items()}
+            with generate_lock, torch.inference_mode():
+                generated = model.generate(
+                    **encoded,
+                    forced_bos_token_id=tokenizer.convert_tokens_to_ids(lang_token(target_lang)),
+                    max_new_tokens=max_new_tokens_for(input_length),
+                    num_beams=num_beams,
+                    do_sample=False,
+                    early_stopping=num_beams > 1,
+                    use_cache=True,
+                    pad_token_id=tokenizer.pad_token_id
+                )
+            decoded = tokenizer.batch_decode(generated, skip_special_tokens=True)
+    except Exception as e:
+        print(f"[TRANSLATE-ERROR] Translation error: {e}")
+        return [None] * len(texts)
+    
+    results = []
+    for text, result in zip(texts, decoded):
         # Apply manual corrections
         corrected_result = apply_translation_corrections(result, TRANSLATION_CORRECTIONS)
         
-        log_result = result[:50] + "..." if len(result) > 50 else result
-        log_corrected = corrected_result[:50] + "..." if len(corrected_result) > 50 else corrected_result
-        
-        print(f"[TRANSLATE-DEBUG] Raw output: '{log_result}'")
-        if corrected_result != result:
-            print(f"[TRANSLATE-DEBUG] After corrections: '{log_corrected}'")
+        if DEBUG:
+            log_result = result[:50] + "..." if len(result) > 50 else result
+            log_corrected = corrected_result[:50] + "..." if len(corrected_result) > 50 else corrected_result
+            
+            print(f"[TRANSLATE-DEBUG] Raw output: '{log_result}'")
+            if corrected_result != result:
+                print(f"[TRANSLATE-DEBUG] After corrections: '{log_corrected}'")
         
         # Verify result is reasonable
         if len(corrected_result.strip()) < 3:
-            print(f"[TRANSLATE-DEBUG] Result too short, using original")
-            return text  # Fallback to original
-        
-        return corrected_result
-    except Exception as e:
-        print(f"[TRANSLATE-ERROR] Translation error: {e}")
-        return text
+            if DEBUG:
+                print(f"[TRANSLATE-DEBUG] Result too short, discarding it")
+            results.append(None)
+        else:
+            results.append(corrected_result)
+    
+    # Greedy output that came back unusably short gets one more try with beam search;
+    # this is rare, so the common path stays greedy. Output equal to the input is kept:
+    # names, "LED" or model numbers are legitimately passed through unchanged
+    if num_beams == 1 and RETRY_BEAMS > 1:
+        retry = [i for i, (text, result) in enumerate(zip(texts, results))
+                 if len(text.strip()) >= 3 and result is None]
+        if retry:
+            if DEBUG:
+                print(f"[TRANSLATE-DEBUG] Retrying {len(retry)} chunk(s) with {RETRY_BEAMS} beams")
+            retried = translate_batch([texts[i] for i in retry], target_lang, RETRY_BEAMS, source_lang=source_lang)
+            for i, result in zip(retry, retried):
+                results[i] = result
+    
+    return results
+
+# Compile the smallest padding bucket at startup, so the first file does not pay for it.
+# The first call compiles; reduce-overhead mode records its CUDA graphs on the second
+if model_compiled:
+    print("[INFO] Warming up the compiled model...")
+    for _ in range(2):
+        translate_batch(["Warm-up."], TARGET_LANG)
+
+# Elements whose text is code, markup or formulas rather than prose
+SKIP_TAGS = frozenset({'script', 'style', 'code', 'pre', 'math', 'svg'})
 
 def extract_and_translate_text_nodes(soup, translator_func, log_callback):
     """Extract text nodes, translate them, and put them back with proper spacing"""
+    # Collect text nodes in document order before any are replaced, without
+    # descending into SKIP_TAGS subtrees at all
     text_nodes = []
+    stack = list(reversed(soup.contents))
+    while stack:
+        node = stack.pop()
+        # Exact type check: comments, CDATA and doctypes are NavigableString subclasses
+        if type(node) is NavigableString:
+            if node:
+                text_nodes.append(node)
+        elif hasattr(node, 'contents') and node.name not in SKIP_TAGS:
+            stack.extend(reversed(node.contents))
     
-    # Find all text nodes, preserving original spacing
-    def find_text_nodes(element):
-        for child in element.children:
-            if isinstance(child, NavigableString):
-                original_text = str(child)
-                # Keep nodes that have meaningful content (including whitespace-only if needed for spacing)
-                if original_text and child.parent.name not in ['script', 'style']:
-                    text_nodes.append({
-                        'node': child,
-                        'text': original_text,
-                        'stripped': original_text.strip(),
-                        'leading_space': original_text.startswith(' ') or original_text.startswith('\t'),
-                        'trailing_space': original_text.endswith(' ') or original_text.endswith('\t')
-                    })
-            elif hasattr(child, 'children'):
-                find_text_nodes(child)
-    
-    find_text_nodes(soup)
-    
-    # Translate each meaningful text node
-    for text_info in text_nodes:
-        stripped_text = text_info['stripped']
+    # Group nodes by their text so each distinct phrase is translated once
+    nodes_by_text = {}
+    for node in text_nodes:
+        stripped_text = node.strip()
         if stripped_text and len(stripped_text) > 1:
-            try:
-                translated_text = translator_func(stripped_text)
-                
-                # Preserve original spacing
-                final_text = translated_text
-                if text_info['leading_space']:
-                    final_text = ' ' + final_text
-                if text_info['trailing_space']:
-                    final_text = final_text + ' '
-                
-                log_callback(f"[TEXT] '{text_info['text']}' → '{final_text}'")
-                text_info['node'].replace_with(final_text)
-            except Exception as e:
-                log_callback(f"[WARN] Failed to translate: {stripped_text[:30]}... ({e})")
+            nodes_by_text.setdefault(stripped_text, []).append(node)
+    
+    for stripped_text, nodes in nodes_by_text.items():
+        try:
+            translated_text = translator_func(stripped_text)
+        except Exception as e:
+            log_callback(f"[WARN] Failed to translate: {stripped_text[:30]}... ({e})")
+            continue
+        
+        for node in nodes:
+            # Preserve original spacing
+            final_text = translated_text
+            if node[:1].isspace():
+                final_text = ' ' + final_text
+            if node[-1:].isspace():
+                final_text = final_text + ' '
+            
+            if DEBUG:
+                log_callback(f"[TEXT] '{node}' → '{final_text}'")
+            node.replace_with(final_text)
+
+# A real tag, comment or doctype; "a < b > c" in plain text does not match
+HTML_TAG_RE = re.compile(r'<[a-zA-Z/!][^>]*>')
+
+def looks_like_html(text):
+    """True if text contains markup that needs the HTML translation path"""
+    return HTML_TAG_RE.search(text) is not None
+
+# Block elements translated as a whole by translate_html_by_element_context
+BLOCK_TAGS = ['li', 'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'div']
+
+def html_blocks(soup):
+    """(element, text) for the outermost block elements of a parsed fragment that carry text"""
+    blocks = []
+    for element in soup.find_all(BLOCK_TAGS):
+        if element.find_parent(BLOCK_TAGS) is None:
+            text = element.get_text().strip()
+            if len(text) > 1:
+                blocks.append((element, text))
+    return blocks
 
 def translate_html_by_element_context(html, translator_func, log_callback):
     """Translate by element context, preserving inline formatting"""
@@ -200,42 +601,53 @@ def translate_html_by_element_context(html, translator_func, log_callback):
         return html
     
     # Handle plain text
-    if "<" not in html or ">" not in html:
+    if not looks_like_html(html):
         translated = translator_func(html)
-        log_callback(f"[PLAIN] {html[:40]}... → {translated[:40]}...")
+        if DEBUG:
+            log_callback(f"[PLAIN] {html[:40]}... → {translated[:40]}...")
         return translated
     
     try:
         soup = BeautifulSoup(html, "html.parser")
-        log_callback(f"[HTML-DEBUG] Processing HTML: {html[:60]}...")
+        if DEBUG:
+            log_callback(f"[HTML-DEBUG] Processing HTML: {html[:60]}...")
         
         # Find elements with text content to translate
         translated_any = False
-        for element in soup.find_all(['li', 'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'div']):
+        for element in soup.find_all(BLOCK_TAGS):
+            # Skip blocks nested in an element that was already rewritten (e.g. <p> inside <li>);
+            # clearing the outer element detached them, so their text is already translated
+            if not any(parent is soup for parent in element.parents):
+                continue
+            
             # Get full text content
-            full_text = element.get_text()
-            if full_text.strip() and len(full_text.strip()) > 1:
+            full_text = element.get_text().strip()
+            if full_text and len(full_text) > 1:
                 try:
-                    log_callback(f"[HTML-DEBUG] Translating element text: '{full_text[:50]}...'")
+                    if DEBUG:
+                        log_callback(f"[HTML-DEBUG] Translating element text: '{full_text[:50]}...'")
                     # Translate the complete text
-                    translated_text = translator_func(full_text.strip())
-                    log_callback(f"[HTML-DEBUG] Translation result: '{translated_text[:50]}...'")
+                    translated_text = translator_func(full_text)
+                    if DEBUG:
+                        log_callback(f"[HTML-DEBUG] Translation result: '{translated_text[:50]}...'")
                     
                     # Check if translation actually changed
-                    if translated_text.strip() != full_text.strip():
-                        log_callback(f"[HTML-DEBUG] Translation changed, updating element")
+                    if translated_text.strip() != full_text:
+                        if DEBUG:
+                            log_callback(f"[HTML-DEBUG] Translation changed, updating element")
                         # Clear and rebuild with basic structure
                         element.clear()
                         element.string = translated_text
                         translated_any = True
-                    else:
+                    elif DEBUG:
                         log_callback(f"[HTML-DEBUG] Translation unchanged, keeping original")
                     
                 except Exception as e:
                     log_callback(f"[HTML-ERROR] Element translation failed: {e}")
         
         result = str(soup)
-        log_callback(f"[HTML-DEBUG] Final result: {result[:60]}...")
+        if DEBUG:
+            log_callback(f"[HTML-DEBUG] Final result: {result[:60]}...")
         
         if translated_any:
             return result
@@ -295,18 +707,37 @@ def translate_html_simple_fallback(html, translator_func, log_callback):
         log_callback(f"[ERROR] Fallback translation failed: {e}")
         return html
 
+def html_plain_text(html):
+    """Text content of an HTML fragment, using lxml's C parser when available"""
+    if HAVE_LXML:
+        try:
+            return lxml.html.fragment_fromstring(html, create_parent="div").text_content()
+        except Exception:
+            pass  # Fall back to BeautifulSoup for anything lxml rejects
+    return BeautifulSoup(html, "html.parser").get_text()
+
+def has_text(html):
+    """Check that translated HTML still carries text, parsing only if the tag-stripping estimate finds none"""
+    if HTML_TAG_RE.sub('', html).strip():
+        return True
+    return bool(html_plain_text(html).strip())
+
 def translate_html_robust(html, translator_func, log_callback):
     """Robust HTML translation with multiple fallback strategies"""
     if not html or not html.strip():
         return html
     
+    # Without real tags there is nothing to preserve: skip parsing and validation
+    if not looks_like_html(html):
+        return translator_func(html)
+    
     # Strategy 1: Element context translation
     try:
         result = translate_html_by_element_context(html, translator_func, log_callback)
         
-        # Validate result
-        test_soup = BeautifulSoup(result, "html.parser")
-        if test_soup.get_text().strip() and len(test_soup.get_text()) > 10:
+        # Only an empty result sends the field on to the next strategy; short
+        # fields such as "<p>Ja</p>" are valid translations
+        if has_text(result):
             return result
         else:
             log_callback("[WARN] Strategy 1 failed, trying text extraction")
@@ -317,11 +748,10 @@ def translate_html_robust(html, translator_func, log_callback):
     try:
         soup = BeautifulSoup(html, "html.parser")
         extract_and_translate_text_nodes(soup, translator_func, log_callback)
-        result = str(soup)
         
-        test_soup = BeautifulSoup(result, "html.parser")
-        if test_soup.get_text().strip() and len(test_soup.get_text()) > 10:
-            return result
+        # Validate on the tree we already have instead of parsing the result again
+        if soup.get_text().strip():
+            return str(soup)
         else:
             log_callback("[WARN] Strategy 2 failed, trying fallback")
     except Exception as e:
@@ -335,161 +765,293 @@ def translate_html_robust(html, translator_func, log_callback):
         log_callback(f"[ERROR] All strategies failed: {e}")
         return html
 
-def translate_json_fields(data, translator_func, log_callback, target_lang, translated_flags=None, current_path="root"):
-    if translated_flags is None:
-        translated_flags = set()
-
-    translatable_keys = {
-        "text", "question", "title", "alt", "label", "contentName",
-        "introduction", "startButtonText", "checkAnswerButton", "submitAnswerButton", 
-        "showSolutionButton", "tryAgainButton", "tipsLabel", "scoreBarLabel",
-        "tipAvailable", "feedbackAvailable", "readFeedback", "wrongAnswer", 
-        "correctAnswer", "shouldCheck", "shouldNotCheck", "noInput",
-        "header", "body", "cancelLabel", "confirmLabel", "tip", 
-        "chosenFeedback", "notChosenFeedback"
-    }
+# Content.json keys whose string values are shown to learners
+TRANSLATABLE_KEYS = frozenset({
+    "text", "question", "title", "alt", "label", "contentName",
+    "introduction", "startButtonText", "checkAnswerButton", "submitAnswerButton", 
+    "showSolutionButton", "tryAgainButton", "tipsLabel", "scoreBarLabel",
+    "tipAvailable", "feedbackAvailable", "readFeedback", "wrongAnswer", 
+    "correctAnswer", "shouldCheck", "shouldNotCheck", "noInput",
+    "header", "body", "cancelLabel", "confirmLabel", "tip", 
+    "chosenFeedback", "notChosenFeedback"
+})
 
-    if isinstance(data, dict):
-        for key, value in data.items():
-            path = f"{current_path}/{key}"
-            if path in translated_flags:
-                continue
+def format_path(path):
+    """Readable form of a walker path tuple, e.g. ("content", 0, "text") -> root/content[0]/text"""
+    return "root" + "".join(f"[{part}]" if type(part) is int else f"/{part}" for part in path)
 
-            # Debug logging for path tracking
-            if key in ["answers", "questions"] and isinstance(value, list):
-                log_callback(f"[DEBUG] Found {key} array at path: {path}")
+def collect_translation_jobs(data, jobs, log_callback, root_path=()):
+    """Walk the content tree iteratively and record every translatable string without translating it.
+    Paths are tuples of keys and list indexes; format_path turns them into text for logging."""
+    # Parsed JSON is a tree, so every container is reached exactly once
+    stack = deque([(data, root_path)])
+    while stack:
+        node, current_path = stack.pop()
+        node_type = type(node)
 
-            if key in translatable_keys and isinstance(value, str) and value.strip():
-                try:
-                    original_value = value
-                    if "<" in value and ">" in value:
-                        translated = translate_html_robust(value, lambda x: translator_func(x, target_lang), log_callback)
-                    else:
-                        translated = translator_func(value, target_lang)
-                        log_callback(f"[FIELD] {value[:50]}... → {translated[:50]}...")
-                    
-                    # Additional validation
-                    if len(translated.strip()) < 3:
-                        log_callback(f"[WARN] Translation too short, keeping original for {key}")
-                        translated = original_value
-                    
-                    data[key] = translated
-                    translated_flags.add(path)
-                except Exception as e:
-                    log_callback(f"[WARN] Couldn't translate {key} at {path}: {e}")
-                continue
+        if node_type is dict:
+            for key, value in node.items():
+                path = current_path + (key,)
 
-            # Special handling for answers arrays
-            if key == "answers" and isinstance(value, list):
-                log_callback(f"[DEBUG] Processing answers array with {len(value)} items")
-                for idx, answer in enumerate(value):
-                    answer_path = f"{path}[{idx}]"
-                    log_callback(f"[DEBUG] Processing answer {idx} at {answer_path}")
-                    
-                    if isinstance(answer, dict):
-                        # Handle the "text" field in answers
-                        if "text" in answer:
-                            sub_path = f"{answer_path}/text"
-                            if sub_path not in translated_flags:
-                                orig = answer["text"]
-                                if isinstance(orig, str) and orig.strip():
-                                    try:
-                                        log_callback(f"[DEBUG] Translating answer text: {orig[:60]}...")
-                                        if "<" in orig and ">" in orig:
-                                            translated = translate_html_robust(orig, lambda x: translator_func(x, target_lang), log_callback)
-                                        else:
-                                            translated = translator_func(orig, target_lang)
-                                        
-                                        if len(translated.strip()) >= 3:
-                                            answer["text"] = translated
-                                            translated_flags.add(sub_path)
-                                            log_callback(f"[ANSWER] {orig[:50]}... → {translated[:50]}...")
-                                        else:
-                                            log_callback(f"[WARN] Answer translation too short, keeping original")
-                                    except Exception as e:
-                                        log_callback(f"[ERROR] Translating answer[{idx}] text failed: {orig[:40]}... ({e})")
-                                else:
-                                    log_callback(f"[DEBUG] Answer text empty or invalid: '{orig}'")
-                        else:
-                            log_callback(f"[DEBUG] Answer {idx} has no 'text' field")
-                        
-                        # Also recursively process the rest of the answer object (for nested structures)
-                        translate_json_fields(answer, translator_func, log_callback, target_lang, translated_flags, answer_path)
-                    else:
-                        log_callback(f"[DEBUG] Answer {idx} is not a dict: {type(answer)}")
-                continue
+                # Exact type checks: parsed JSON only contains plain dict/list/str
+                value_type = type(value)
+                if value_type is str:
+                    if key in TRANSLATABLE_KEYS and should_translate(value):
+                        jobs.append((node, key, value, looks_like_html(value), path))
+                elif value_type is dict or value_type is list:
+                    # Debug logging for path tracking
+                    if value_type is list and (key == "answers" or key == "questions"):
+                        if DEBUG:
+                            log_callback(f"[DEBUG] Found {key} array at path: {format_path(path)} with {len(value)} items")
+                    stack.append((value, path))
 
-            # Special handling for questions arrays
-            if key == "questions" and isinstance(value, list):
-                log_callback(f"[DEBUG] Processing questions array with {len(value)} items")
-                for idx, question in enumerate(value):
-                    question_path = f"{path}[{idx}]"
-                    log_callback(f"[DEBUG] Processing question {idx} at {question_path}")
-                    translate_json_fields(question, translator_func, log_callback, target_lang, translated_flags, question_path)
-                continue
+        elif node_type is list:
+            for idx, item in enumerate(node):
+                item_type = type(item)
+                if item_type is dict or item_type is list:
+                    stack.append((item, current_path + (idx,)))
+                elif item_type is str:
+                    if should_translate(item):
+                        jobs.append((node, idx, item, looks_like_html(item), current_path + (idx,)))
 
-            # Regular recursive processing for other nested structures
-            if isinstance(value, (dict, list)):
-                translate_json_fields(value, translator_func, log_callback, target_lang, translated_flags, path)
+def translate_json_fields(data, translator_func, log_callback, target_lang, source_lang=SOURCE_LANG):
+    """Translate all fields in two passes: collect every string, then translate them in batches.
+    
+    translator_func takes a list of strings, a target language and a failed= keyword, and returns
+    the translations, adding the indexes of strings it could not translate to the failed set (as
+    translate_texts does). It should cache its results so the batched HTML block pass pays off.
+    """
+    jobs = []
+    collect_translation_jobs(data, jobs, log_callback)
+    log_callback(f"[INFO] Collected {len(jobs)} translatable strings")
 
-    elif isinstance(data, list):
-        for idx, item in enumerate(data):
-            path = f"{current_path}[{idx}]"
-            if isinstance(item, (dict, list)):
-                translate_json_fields(item, translator_func, log_callback, target_lang, translated_flags, path)
-            elif isinstance(item, str) and path not in translated_flags:
-                try:
-                    if "<" in item and ">" in item:
-                        translated = translate_html_robust(item, lambda x: translator_func(x, target_lang), log_callback)
-                    else:
-                        translated = translator_func(item, target_lang)
-                    
-                    if len(translated.strip()) >= 3:
-                        data[idx] = translated
-                        translated_flags.add(path)
-                        log_callback(f"[LIST] {item[:30]}... → {translated[:30]}...")
-                    else:
-                        log_callback(f"[WARN] List item translation too short, keeping original")
-                except Exception as e:
-                    log_callback(f"[WARN] Couldn't translate list item at {path}: {e}")
+    def store_translation(container, key, original, translated, path):
+        # Additional validation
+        if len(translated.strip()) < 3:
+            log_callback(f"[WARN] Translation too short, keeping original at {format_path(path)}")
+            return
+        container[key] = translated
+        log_callback(f"[FIELD] {original[:50]}... → {translated[:50]}...")
 
-def fix_moodle_h5p_for_lumi(input_h5p, log_callback):
-    """Fix Moodle H5P files for Lumi compatibility by removing missing library references"""
-    temp_dir = "temp_lumi_fix"
+    plain_jobs = [job for job in jobs if not job[3]]
+    html_jobs = []
     
-    if os.path.exists(temp_dir):
-        shutil.rmtree(temp_dir)
+    # Whole HTML fragments recur too (feedback templates, repeated answer markup)
+    for job in jobs:
+        if not job[3]:
+            continue
+        cached = _HTML_CACHE.get((source_lang, target_lang, job[2]))
+        if cached is not None:
+            store_translation(job[0], job[1], job[2], cached, job[4])
+        else:
+            html_jobs.append(job)
+
+    # Parse every HTML field once and keep the tree: its block texts go through the
+    # model in the same batch as the plain strings and are then written back in place
+    parsed_html = []
+    block_texts = []
+    for job in html_jobs:
+        soup, blocks, start = None, [], len(block_texts)
+        try:
+            soup = BeautifulSoup(job[2], "html.parser")
+            blocks = html_blocks(soup)
+            if blocks:
+                block_texts.extend(text for _, text in blocks)
+            else:
+                # No blocks: translate_html_robust's plain text fallback will ask for this
+                plain_text = soup.get_text().strip()
+                if plain_text:
+                    block_texts.append(plain_text)
+        except Exception as e:
+            log_callback(f"[WARN] Couldn't pre-collect HTML text at {format_path(job[4])}: {e}")
+        parsed_html.append((job, soup, blocks, start))
+
+    translated_blocks = []
+    failed_blocks = set()  # Indexes into block_texts the model failed on
+    if plain_jobs or block_texts:
+        try:
+            failed = set()
+            translated_all = translator_func([job[2] for job in plain_jobs] + block_texts, target_lang, failed=failed)
+            for (container, key, original, _, path), translated in zip(plain_jobs, translated_all):
+                store_translation(container, key, original, translated, path)
+            translated_blocks = translated_all[len(plain_jobs):]
+            failed_blocks = {idx - len(plain_jobs) for idx in failed if idx >= len(plain_jobs)}
+        except Exception as e:
+            log_callback(f"[WARN] Batch translation failed: {e}")
+
+    # HTML fields need per-element handling to keep their markup
+    for (container, key, original, _, path), soup, blocks, start in parsed_html:
+        try:
+            html_key = (source_lang, target_lang, original)
+            translated = _HTML_CACHE.get(html_key)
+            if translated is None:
+                # Same rewrite as translate_html_by_element_context, on the tree parsed above
+                field_blocks = translated_blocks[start:start + len(blocks)]
+                changed = False
+                # Blocks the model failed on keep their markup, and the field is not cached
+                field_failed = any(start + i in failed_blocks for i in range(len(blocks)))
+                complete = len(field_blocks) == len(blocks)
+                if complete:
+                    for i, ((element, text), translated_text) in enumerate(zip(blocks, field_blocks)):
+                        if start + i in failed_blocks:
+                            continue
+                        if translated_text.strip() != text:
+                            element.clear()
+                            element.string = translated_text
+                            changed = True
+                        elif element.find(BLOCK_TAGS) is not None:
+                            # Strategy 1 goes on to translate the nested blocks one by one
+                            complete = False
+                            break
+                result = str(soup) if complete and changed else None
+                if result is not None and has_text(result):
+                    translated = result
+                else:
+                    # Nothing usable from the shared tree: run the full strategy chain
+                    field_failed = False
+                    def translate_one(text):
+                        nonlocal field_failed
+                        failed = set()
+                        translated_text = translator_func([text], target_lang, failed=failed)[0]
+                        field_failed = field_failed or bool(failed)
+                        return translated_text
+                    translated = translate_html_robust(original, translate_one, log_callback)
+                # Leave fields the model failed on to be retried
+                if not field_failed and translated != original:
+                    cache_put(_HTML_CACHE, html_key, translated)
+            store_translation(container, key, original, translated, path)
+        except Exception as e:
+            log_callback(f"[WARN] Couldn't translate {key} at {format_path(path)}: {e}")
+
+def loads_json(data):
+    """Parse UTF-8 JSON bytes, using orjson when available"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data.decode('utf-8'))
+
+def dumps_json(obj, pretty=True):
+    """Serialize to UTF-8 JSON bytes (indented unless pretty=False), using orjson when available"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if pretty else None).encode('utf-8')
+
+def cache_settings():
+    """Everything that shapes a cached translation: model, backend, decoding settings and
+    corrections (cached translations already have the corrections applied)"""
+    corrections = json.dumps(TRANSLATION_CORRECTIONS, sort_keys=True, ensure_ascii=False)
+    return {
+        "model": MODEL_NAME,
+        "backend": model_backend,
+        "decoding": [BEAM_SIZE_SHORT, BEAM_SIZE_LONG, SHORT_INPUT_TOKENS, RETRY_BEAMS, MAX_INPUT_TOKENS],
+        "corrections": hashlib.sha1(corrections.encode('utf-8')).hexdigest(),
+    }
+
+def load_translation_cache(path=TCACHE_FILE):
+    """Fill _TCACHE from a previous run's cache file, if it was made with the same settings"""
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with open(path, 'rb') as f:
+            saved = loads_json(f.read())
+        if saved.get("settings") != cache_settings():
+            print(f"[INFO] Ignoring {path}: it was made with a different model, backend, decoding or corrections")
+            return
+        for source_lang, target_lang, text, translated in saved["entries"]:
+            cache_put(_TCACHE, (source_lang, target_lang, text), translated)
+        print(f"[INFO] Loaded {len(_TCACHE)} cached translations from {path}")
+    except Exception as e:
+        print(f"[WARN] Could not load translation cache {path}: {e}")
+
+def save_translation_cache(path=TCACHE_FILE):
+    """Write _TCACHE to disk; the file is replaced atomically so a crash never truncates it"""
+    if not path:
+        return
+    # Outputs that only echo the source are not worth keeping across runs
+    with _CACHE_LOCK:
+        items = list(_TCACHE.items())
+    entries = [[*key, translated] for key, translated in items
+               if canonical_text(translated) != key[2]]
+    try:
+        with open(path + ".tmp", 'wb') as f:
+            f.write(dumps_json({"settings": cache_settings(), "entries": entries}, pretty=False))
+        os.replace(path + ".tmp", path)
+    except Exception as e:
+        print(f"[WARN] Could not save translation cache {path}: {e}")
+
+# Already-compressed media gains nothing from being deflated again
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp4', '.m4v', '.webm', '.ogg', '.mp3', '.m4a',
+                     '.woff', '.woff2', '.pdf', '.zip')
+
+def write_h5p_archive(src, output_path, rewritten):
+    """Copy an open H5P zip to output_path, replacing the entries given in rewritten.
     
-    # Extract H5P file
-    with zipfile.ZipFile(input_h5p, 'r') as zip_ref:
-        zip_ref.extractall(temp_dir)
+    Untouched entries are streamed across with their timestamp and permissions.
+    Entries that were stored uncompressed, and media files, are stored; everything
+    else is deflated at level 1. Rewritten entries keep their permissions.
+    """
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as dst:
+        # Follow the entries' physical order so the input is read sequentially,
+        # even when the central directory lists them in a different order
+        for info in sorted(src.infolist(), key=lambda i: i.header_offset):
+            if info.is_dir():
+                continue
+            if info.filename in rewritten:
+                target = zipfile.ZipInfo(info.filename, date_time=time.localtime()[:6])
+                target.external_attr = info.external_attr
+                dst.writestr(target, rewritten[info.filename], zipfile.ZIP_DEFLATED, 1)
+                continue
+            
+            target = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+            target.external_attr = info.external_attr
+            # The real size lets ZipFile.open write ZIP64 headers for entries over 2 GiB
+            target.file_size = info.file_size
+            if info.compress_type == zipfile.ZIP_STORED or info.filename.lower().endswith(STORED_EXTENSIONS):
+                target.compress_type = zipfile.ZIP_STORED
+            else:
+                target.compress_type = zipfile.ZIP_DEFLATED
+                # ZipFile.open only applies the archive's level to entries it names itself;
+                # Python 3.13 made the ZipInfo attribute public
+                if hasattr(target, "compress_level"):
+                    target.compress_level = 1
+                elif hasattr(target, "_compresslevel"):
+                    target._compresslevel = 1
+            with src.open(info) as fsrc, dst.open(target, 'w') as fdst:
+                shutil.copyfileobj(fsrc, fdst, 64 * 1024)
+
+def lumi_fixes(src, log_callback):
+    """Compute Lumi compatibility fixes for an open H5P zip.
     
+    Returns the parsed h5p.json/content.json that need rewriting, keyed by
+    entry name, or an empty dict when the package needs no fixes.
+    """
+    # Work on the archive in memory: only h5p.json and content.json can change
+    names = src.namelist()
+
     log_callback("[LUMI-FIX] Checking for missing library references...")
-    
+
     # Load main H5P metadata
-    h5p_json_path = os.path.join(temp_dir, "h5p.json")
-    content_json_path = os.path.join(temp_dir, "content", "content.json")
-    
+    h5p_json_name = "h5p.json"
+    content_json_name = "content/content.json"
+
     fixed_anything = False
-    
+    fixed = {}
+
     # Fix h5p.json - remove references to missing libraries
-    if os.path.exists(h5p_json_path):
-        with open(h5p_json_path, 'r', encoding='utf-8') as f:
-            h5p_json = json.load(f)
-        
-        # Check what library folders actually exist
-        existing_libraries = set()
-        for item in os.listdir(temp_dir):
-            if os.path.isdir(os.path.join(temp_dir, item)) and item not in ['content', 'temp_lumi_fix']:
-                existing_libraries.add(item)
-        
+    if h5p_json_name in names:
+        h5p_json = loads_json(src.read(h5p_json_name))
+    
+        # Check what library folders actually exist (top-level folders in the archive)
+        existing_libraries = {name.split('/', 1)[0] for name in names if '/' in name}
+        existing_libraries.discard('content')
+    
         log_callback(f"[LUMI-FIX] Found library folders: {existing_libraries}")
-        
+    
         # Remove missing dependencies
         if "preloadedDependencies" in h5p_json:
             original_deps = h5p_json["preloadedDependencies"][:]
             h5p_json["preloadedDependencies"] = []
-            
+        
             for dep in original_deps:
                 lib_folder = f"{dep['machineName']}-{dep['majorVersion']}.{dep['minorVersion']}"
                 if lib_folder in existing_libraries:
@@ -498,12 +1060,12 @@ def fix_moodle_h5p_for_lumi(input_h5p, log_callback):
                 else:
                     log_callback(f"[LUMI-FIX] Removed missing dependency: {lib_folder}")
                     fixed_anything = True
-        
+    
         # Same for editor dependencies
         if "editorDependencies" in h5p_json:
             original_deps = h5p_json["editorDependencies"][:]
             h5p_json["editorDependencies"] = []
-            
+        
             for dep in original_deps:
                 lib_folder = f"{dep['machineName']}-{dep['majorVersion']}.{dep['minorVersion']}"
                 if lib_folder in existing_libraries:
@@ -511,16 +1073,14 @@ def fix_moodle_h5p_for_lumi(input_h5p, log_callback):
                 else:
                     log_callback(f"[LUMI-FIX] Removed missing editor dependency: {lib_folder}")
                     fixed_anything = True
-        
-        # Save fixed h5p.json
-        with open(h5p_json_path, 'w', encoding='utf-8') as f:
-            json.dump(h5p_json, f, ensure_ascii=False, indent=2)
     
+        # Keep fixed h5p.json
+        fixed[h5p_json_name] = h5p_json
+
     # Fix content.json - remove showWhen and other editor-specific fields
-    if os.path.exists(content_json_path):
-        with open(content_json_path, 'r', encoding='utf-8') as f:
-            content = json.load(f)
-        
+    if content_json_name in names:
+        content = loads_json(src.read(content_json_name))
+    
         def remove_editor_fields_recursively(obj, path=""):
             nonlocal fixed_anything
             if isinstance(obj, dict):
@@ -534,87 +1094,68 @@ def fix_moodle_h5p_for_lumi(input_h5p, log_callback):
                         fixed_anything = True
                     else:
                         remove_editor_fields_recursively(value, current_path)
-                
+            
                 for key in keys_to_remove:
                     del obj[key]
-                    
+                
             elif isinstance(obj, list):
                 for i, item in enumerate(obj):
                     remove_editor_fields_recursively(item, f"{path}[{i}]")
-        
+    
         remove_editor_fields_recursively(content)
-        
-        # Save fixed content.json
-        with open(content_json_path, 'w', encoding='utf-8') as f:
-            json.dump(content, f, ensure_ascii=False, indent=2)
-    
-    if fixed_anything:
-        # Create fixed H5P file
-        fixed_filename = input_h5p.replace('.h5p', '_lumi_fixed.h5p')
-        with zipfile.ZipFile(fixed_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, _, files in os.walk(temp_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, temp_dir)
-                    zipf.write(file_path, arcname)
-        
-        log_callback(f"[✅] Lumi compatibility fixes applied: {fixed_filename}")
-        shutil.rmtree(temp_dir)
-        return fixed_filename
-    else:
+    
+        # Keep fixed content.json
+        fixed[content_json_name] = content
+
+    if not fixed_anything:
         log_callback("[LUMI-FIX] No fixes needed - file should work in Lumi as-is")
-        shutil.rmtree(temp_dir)
-        return input_h5p
+        return {}
+    return fixed
 
 def translate_h5p(input_h5p, output_h5p, log_callback, source_lang, target_lang, export_raw=False, fix_for_lumi=False):
-    # Update tokenizer source language
-    global tokenizer
-    tokenizer.src_lang = source_lang
-    
-    # Apply Lumi compatibility fixes first if requested
-    working_file = input_h5p
-    if fix_for_lumi:
-        log_callback("[INFO] Applying Lumi compatibility fixes...")
-        working_file = fix_moodle_h5p_for_lumi(input_h5p, log_callback)
-    
-    temp_dir = "temp_h5p"
-    content_json_path = os.path.join(temp_dir, "content", "content.json")
-
-    if os.path.exists(temp_dir):
-        shutil.rmtree(temp_dir)
+    content_json_name = "content/content.json"
 
-    with zipfile.ZipFile(working_file, 'r') as zip_ref:
-        zip_ref.extractall(temp_dir)
-    log_callback("[OK] Extracted H5P")
+    # Stream the package: only h5p.json and content.json are rewritten, every
+    # other entry is copied straight from the input zip without touching the disk
+    with zipfile.ZipFile(input_h5p, 'r') as src:
+        # Apply Lumi compatibility fixes first if requested; they are written
+        # together with the translation instead of through a temporary package
+        fixed = {}
+        if fix_for_lumi:
+            log_callback("[INFO] Applying Lumi compatibility fixes...")
+            fixed = lumi_fixes(src, log_callback)
+            if fixed:
+                log_callback("[✅] Lumi compatibility fixes applied")
 
-    with open(content_json_path, 'r', encoding='utf-8') as f:
-        content = json.load(f)
+        if content_json_name in fixed:
+            content = fixed.pop(content_json_name)
+        else:
+            content = loads_json(src.read(content_json_name))
+        log_callback("[OK] Loaded content.json from H5P")
 
-    log_callback("[INFO] Starting translation...")
-    translate_json_fields(content, translate_local_ai, log_callback, target_lang)
+        log_callback("[INFO] Starting translation...")
+        cache_stats = {"hits": 0, "translated": 0}
+        translate_json_fields(
+            content, lambda texts, lang, failed=None: translate_texts(texts, lang, cache_stats, source_lang, failed),
+            log_callback, target_lang, source_lang
+        )
+        log_callback(f"[INFO] Translation cache: {cache_stats['hits']} hits, "
+                     f"{cache_stats['translated']} strings sent to the model")
 
-    with open(content_json_path, 'w', encoding='utf-8') as f:
-        json.dump(content, f, ensure_ascii=False, indent=2)
+        rewritten = {name: dumps_json(obj) for name, obj in fixed.items()}
+        rewritten[content_json_name] = dumps_json(content)
+        write_h5p_archive(src, output_h5p, rewritten)
 
     if export_raw:
-        shutil.make_archive("file-we-just-translated", 'zip', temp_dir)
-
-    with zipfile.ZipFile(output_h5p, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, _, files in os.walk(temp_dir):
-            for file in files:
-                path = os.path.join(root, file)
-                arcname = os.path.relpath(path, temp_dir)
-                zipf.write(path, arcname)
+        # Named after the output, so files translated in parallel don't overwrite each other's copy
+        shutil.copyfile(output_h5p, os.path.splitext(output_h5p)[0] + "_raw.zip")
 
     log_callback(f"[✅] Translated and saved: {output_h5p}")
-    shutil.rmtree(temp_dir)
-    
-    # Clean up temporary fixed file if we created one
-    if fix_for_lumi and working_file != input_h5p and os.path.exists(working_file):
-        os.remove(working_file)
-        log_callback("[INFO] Cleaned up temporary Lumi-fixed file")
 
 # === GUI ===
+MAX_PARALLEL_FILES = 2  # Files translated at once when several are selected
+MAX_LOG_LINES = 2000    # Lines kept in the log widget; translation-log.txt keeps everything
+
 class TranslatorGUI:
     def __init__(self, root):
         self.root = root
@@ -622,14 +1163,18 @@ class TranslatorGUI:
         self.root.geometry("900x750")
 
         self.file_path = tk.StringVar()
+        self.selected_files = ()  # Paths from the file dialog; file_path only displays them
         self.output_folder = tk.StringVar()
         self.source_lang = tk.StringVar(value="en")
         self.target_lang = tk.StringVar(value="de")
         self.export_raw = tk.BooleanVar()
         self.fix_for_lumi = tk.BooleanVar()
         self.log_file_path = "translation-log.txt"
+        self.log_file = None
+        self.ui_queue = queue.Queue()  # Log lines and status updates from worker threads
 
         self.setup_ui()
+        self.root.after(100, self.drain_ui_queue)
 
     def setup_ui(self):
     # Initialize language display variables first
@@ -640,7 +1185,7 @@ class TranslatorGUI:
         file_frame = tk.Frame(self.root)
         file_frame.pack(pady=5, fill="x", padx=10)
     
-        tk.Label(file_frame, text="Input H5P File:", font=("Arial", 10, "bold")).pack(anchor="w")
+        tk.Label(file_frame, text="Input H5P File(s):", font=("Arial", 10, "bold")).pack(anchor="w")
         input_frame = tk.Frame(file_frame)
         input_frame.pack(fill="x", pady=(2, 5))
     
@@ -704,7 +1249,7 @@ class TranslatorGUI:
         log_frame.pack(pady=5, fill="both", expand=True, padx=10)
     
         tk.Label(log_frame, text="Translation Log:", font=("Arial", 10, "bold")).pack(anchor="w")
-        self.log = scrolledtext.ScrolledText(log_frame, height=20, width=100)
+        self.log = scrolledtext.ScrolledText(log_frame, height=20, width=100, undo=False)
         self.log.pack(fill="both", expand=True, pady=(5, 0))
 
     # Status
@@ -727,36 +1272,83 @@ class TranslatorGUI:
         if folder:
             self.output_folder.set(folder)
 
+    # Tk widgets may only be touched from the main thread: workers queue their
+    # updates and the Tk main loop applies them in drain_ui_queue
     def log_msg(self, message):
-        self.log.insert(tk.END, message + "\n")
-        self.log.see(tk.END)
-        with open(self.log_file_path, "a", encoding="utf-8") as f:
-            f.write(message + "\n")
-        self.root.update()
+        self.ui_queue.put(("log", message))
 
-    def select_file(self):
-        path = filedialog.askopenfilename(filetypes=[("H5P files", "*.h5p")])
-        if path:
-            self.file_path.set(path)
+    def set_status(self, text, color):
+        self.ui_queue.put(("status", text, color))
 
-    def start_translation(self):
-        file = self.file_path.get()
-        if not file or not file.endswith(".h5p"):
-            messagebox.showerror("Error", "Please select a valid .h5p file.")
-            return
+    def drain_ui_queue(self):
+        """Apply queued status updates and write all queued log messages in one go"""
+        batch = []
+        try:
+            while True:
+                item = self.ui_queue.get_nowait()
+                if item[0] == "log":
+                    batch.append(item[1])
+                else:
+                    self.status.config(text=item[1], fg=item[2])
+        except queue.Empty:
+            pass
+        
+        if batch:
+            text = "\n".join(batch) + "\n"
+            self.log.insert(tk.END, text)
+            # Drop the oldest lines; Tk's Text widget slows down as it grows
+            line_count = int(self.log.index("end-1c").split(".")[0])
+            if line_count > MAX_LOG_LINES:
+                self.log.delete("1.0", f"{line_count - MAX_LOG_LINES + 1}.0")
+            self.log.see(tk.END)
+            if self.log_file:
+                self.log_file.write(text)
+                self.log_file.flush()
+        
+        self.root.after(100, self.drain_ui_queue)
 
-        # Determine output file path
+    def select_file(self):
+        paths = filedialog.askopenfilenames(filetypes=[("H5P files", "*.h5p")])
+        if paths:
+            self.selected_files = tuple(paths)
+            self.file_path.set("; ".join(paths))
+
+    def get_output_path(self, file):
         if self.output_folder.get():
             filename = os.path.basename(file)
             name_without_ext = filename.replace(".h5p", "")
             source_lang_name = SUPPORTED_LANGUAGES.get(self.source_lang.get(), self.source_lang.get())
             target_lang_name = SUPPORTED_LANGUAGES.get(self.target_lang.get(), self.target_lang.get())
-            output_file = os.path.join(self.output_folder.get(), f"{name_without_ext}_{source_lang_name}_to_{target_lang_name}.h5p")
+            return os.path.join(self.output_folder.get(), f"{name_without_ext}_{source_lang_name}_to_{target_lang_name}.h5p")
+        return file.replace(".h5p", "_translated.h5p")
+
+    def start_translation(self):
+        # Use the dialog's list unless the field was edited by hand, which gives a single path
+        entered = self.file_path.get().strip()
+        if self.selected_files and entered == "; ".join(self.selected_files):
+            files = self.selected_files
         else:
-            output_file = file.replace(".h5p", "_translated.h5p")
+            files = [entered] if entered else []
+        if not files or not all(file.endswith(".h5p") for file in files):
+            messagebox.showerror("Error", "Please select a valid .h5p file.")
+            return
+
+        # Determine output file paths; same-named inputs from different folders would share
+        # one output in the output folder, so later ones get a numbered name
+        jobs = []
+        used_outputs = set()
+        for file in files:
+            output_file = self.get_output_path(file)
+            candidate, number = output_file, 2
+            while os.path.normcase(os.path.abspath(candidate)) in used_outputs:
+                candidate = f"{os.path.splitext(output_file)[0]}_{number}.h5p"
+                number += 1
+            used_outputs.add(os.path.normcase(os.path.abspath(candidate)))
+            jobs.append((file, candidate))
 
-        if os.path.exists(output_file):
-            overwrite = messagebox.askyesno("Overwrite?", f"{os.path.basename(output_file)} already exists. Overwrite?")
+        existing = [os.path.basename(output_file) for _, output_file in jobs if os.path.exists(output_file)]
+        if existing:
+            overwrite = messagebox.askyesno("Overwrite?", f"{', '.join(existing)} already exists. Overwrite?")
             if not overwrite:
                 self.status.config(text="Cancelled", fg="orange")
                 return
@@ -768,25 +1360,44 @@ class TranslatorGUI:
 
         self.status.config(text="Translating...", fg="black")
         self.log.delete("1.0", tk.END)
-        with open(self.log_file_path, "w", encoding="utf-8") as f:
-            f.write(f"Translating file: {file}\n")
-            f.write(f"From {SUPPORTED_LANGUAGES.get(self.source_lang.get())} to {SUPPORTED_LANGUAGES.get(self.target_lang.get())}\n")
-            f.write(f"Output: {output_file}\n\n")
+        if self.log_file:
+            self.log_file.close()
+        self.log_file = open(self.log_file_path, "w", encoding="utf-8", buffering=64 * 1024)
+        for file, output_file in jobs:
+            self.log_file.write(f"Translating file: {file}\n")
+            self.log_file.write(f"Output: {output_file}\n")
+        self.log_file.write(f"From {SUPPORTED_LANGUAGES.get(self.source_lang.get())} to {SUPPORTED_LANGUAGES.get(self.target_lang.get())}\n\n")
 
-        threading.Thread(target=self.run_translation, args=(file, output_file, self.source_lang.get(), 
+        threading.Thread(target=self.run_translation, args=(jobs, self.source_lang.get(), 
                                                            self.target_lang.get(), self.export_raw.get(), 
                                                            self.fix_for_lumi.get())).start()
 
-    def run_translation(self, input_file, output_file, source_lang, target_lang, export_raw, fix_for_lumi):
-        try:
-            translate_h5p(input_file, output_file, self.log_msg, source_lang, target_lang, export_raw, fix_for_lumi)
-            self.status.config(text="✅ Translation complete", fg="green")
-        except Exception as e:
-            self.log_msg(f"[ERROR] {e}")
-            self.status.config(text="❌ Error occurred", fg="red")
+    def run_translation(self, jobs, source_lang, target_lang, export_raw, fix_for_lumi):
+        def translate_one(input_file, output_file):
+            log_callback = self.log_msg
+            if len(jobs) > 1:
+                # Prefix messages so interleaved logs from parallel files stay readable
+                name = os.path.basename(input_file)
+                log_callback = lambda message: self.log_msg(f"[{name}] {message}")
+            try:
+                translate_h5p(input_file, output_file, log_callback, source_lang, target_lang, export_raw, fix_for_lumi)
+                return True
+            except Exception as e:
+                log_callback(f"[ERROR] {e}")
+                return False
+
+        with ThreadPoolExecutor(max_workers=MAX_PARALLEL_FILES) as executor:
+            results = list(executor.map(lambda job: translate_one(*job), jobs))
+        save_translation_cache()
+
+        if all(results):
+            self.set_status("✅ Translation complete", "green")
+        else:
+            self.set_status("❌ Error occurred", "red")
 
 # === Run GUI App ===
 if __name__ == "__main__":
+    load_translation_cache()
     root = tk.Tk()
     app = TranslatorGUI(root)
     root.mainloop()
\ No newline at end of file